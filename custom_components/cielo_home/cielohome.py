@@ -1,20 +1,25 @@
 """None."""
 
 import asyncio
-from collections.abc import Awaitable
+from collections.abc import AsyncIterator, Awaitable
 import contextlib
-import copy
-from datetime import datetime
-import json
+import inspect
 import logging
 import re
-import sys
-from threading import Lock, Timer
+import time
 
-from aiohttp import ClientSession, ClientWebSocketResponse, WSMsgType
+from aiohttp import (
+    ClientResponse,
+    ClientSession,
+    ClientTimeout,
+    ClientWebSocketResponse,
+    WSMsgType,
+)
+import orjson
 
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
 
 from .const import URL_API, URL_API_WSS, URL_CIELO, USER_AGENT
 
@@ -24,14 +29,77 @@ TIMEOUT_RECONNECT = 10
 TIME_REFRESH_TOKEN = 3300
 TIMER_PING = 540
 TIMER_PONG = 60
+TIMER_WATCHDOG = 1
+TIME_CACHE_X_API_KEYS = 86400
+STREAM_CHUNK_SIZE = 8192
+
+API_BASE_URL = f"https://{URL_API}"
+API_HEADERS = {
+    "content-type": "application/json; charset=UTF-8",
+    "referer": URL_CIELO,
+    "origin": URL_CIELO,
+    "user-agent": USER_AGENT,
+}
+WSS_URL = f"wss://{URL_API_WSS}/websocket/"
+WSS_HEADERS = {
+    "Host": URL_API_WSS,
+    "Cache-control": "no-cache",
+    "Pragma": "no-cache",
+    "User-agent": USER_AGENT,
+}
+API_TIMEOUT = ClientTimeout(total=30)
+NO_CACHE_HEADERS = {
+    "Cache-Control": "no-cache, no-store, must-revalidate",
+    "Pragma": "no-cache",
+    "Expires": "0",
+}
 
 # TIME_REFRESH_TOKEN = 20
 # TIMER_PING = 100
 
+# aiohttp >= 3.13 can hand TEXT frames over as undecoded bytes, which orjson
+# parses directly without an intermediate str
+_WSS_RAW_TEXT = "decode_text" in inspect.signature(ClientSession.ws_connect).parameters
+# aiohttp >= 3.11 can send an already encoded TEXT frame, skipping the str round trip
+_WSS_SEND_FRAME = hasattr(ClientWebSocketResponse, "send_frame")
+
+_RE_MAIN_JS = re.compile(rb'src="(main\.[^"]{1,200})"')
+_RE_MAIN_JS_MAX_LEN = 256
+_RE_X_API_KEY = re.compile(rb"'([A-Za-z0-9]{40})'")
+_RE_X_API_KEY_MAX_LEN = 42
+_SECRETS = frozenset(("accessToken", "refreshToken", "token"))
+_RE_SECRETS = re.compile(r'("(?:' + "|".join(_SECRETS) + r')"\s*:\s*)"[^"]*"')
+
+
+class _Redacted:
+    """Mask the tokens of a message, only when the log record is emitted."""
+
+    __slots__ = ("_data",)
+
+    def __init__(self, data) -> None:
+        """None."""
+        self._data = data
+
+    def __str__(self) -> str:
+        """None."""
+        data = self._data
+        if isinstance(data, dict):
+            return orjson.dumps(
+                {k: "*****" if k in _SECRETS else v for k, v in data.items()}
+            ).decode()
+        if not isinstance(data, (str, bytes)):
+            data = orjson.dumps(data)
+        if isinstance(data, bytes):
+            data = data.decode(errors="replace")
+        return _RE_SECRETS.sub(r'\1"*****"', data)
+
 
 class CieloHome:
     """Set up Cielo Home api."""
 
+    # x-api-key candidates found in main.js, shared by all the instances
+    _x_api_keys_cache: tuple[list[str], float] | None = None
+
     def __init__(self, hass: HomeAssistant, entry: ConfigEntry) -> None:
         """Set up Cielo Home api."""
         self._is_running: bool = True
@@ -42,13 +110,14 @@ class CieloHome:
         self._user_id: str = ""
         # self._user_name: str = ""
         # self._password: str = ""
-        self._headers: dict[str, str] = {}
+        self._x_api_key: str = None
         self._websocket: ClientWebSocketResponse
         self._ws_session: ClientSession
         self.__event_listener: list[object] = []
-        self._msg_to_send: list[object] = []
-        self._msg_lock = Lock()
-        self._timer_connection_lost: Timer = None
+        self._msg_to_send: asyncio.Queue = asyncio.Queue()
+        # messages not sent by a lost connection, sent before the queue
+        self._msg_pending: list = []
+        self._timer_connection_lost: asyncio.TimerHandle | None = None
         self._last_refresh_token_ts: int
         self._token_expire_in_ts: int
         self._last_ts_msg: int = 0
@@ -62,53 +131,72 @@ class CieloHome:
         self._entry: ConfigEntry = entry
         self._appliance_id = None
         self.background_tasks_wss = set()
-        self._headers = {
-            "content-type": "application/json; charset=UTF-8",
-            "referer": URL_CIELO,
-            "origin": URL_CIELO,
-            "user-agent": USER_AGENT,
-        }
+        self._supervisor: asyncio.Task | None = None
 
     async def close(self):
         """None."""
         self._stop_running = True
         self._is_running = False
-        await asyncio.sleep(0.5)
+        self.stop_timer_connection_lost()
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._supervisor
+            self._supervisor = None
+
+    async def _get_session(self) -> ClientSession:
+        """Return the http session shared by Home Assistant, never closed here."""
+        return async_get_clientsession(self.hass)
 
     def add_listener(self, listener: object):
         """None."""
         self.__event_listener.append(listener)
 
+    def _api_headers(self) -> dict[str, str]:
+        """Return the auth headers of the api requests."""
+        return {
+            **API_HEADERS,
+            "authorization": self._access_token,
+            "x-api-key": self._x_api_key,
+        }
+
     async def set_x_api_key(self) -> bool:
         """Get the x_api_key."""
-        login_url = URL_CIELO
+        cache = CieloHome._x_api_keys_cache
+        if cache is not None and time.monotonic() - cache[1] < TIME_CACHE_X_API_KEYS:
+            self._x_api_keys = cache[0]
+            return True
+
         main_js_url = ""
-        async with ClientSession() as session:
-            session.headers.add("Cache-Control", "no-cache, no-store, must-revalidate")
-            session.headers.add("Pragma", "no-cache")
-            session.headers.add("Expires", "0")
-            async with session.get(
-                login_url + "auth/login?t=" + str(self.get_ts())
-            ) as resp:
-                html_text = await resp.text()
-                index = html_text.find('src="main.')
-                index2 = html_text.find('"', index + 5)
-                main_js_url = html_text[index + 5 : index2].replace('"', "")
+        session = await self._get_session()
+        async with (
+            session.get(
+                f"{URL_CIELO}auth/login?t={self.get_ts()}",
+                headers=NO_CACHE_HEADERS,
+            timeout=API_TIMEOUT,
+            ) as resp,
+            contextlib.aclosing(
+                _async_search_stream(resp, _RE_MAIN_JS, _RE_MAIN_JS_MAX_LEN)
+            ) as matches,
+        ):
+            # the rest of the page is not needed, the connection is dropped
+            async for match in matches:
+                main_js_url = match.group(1).decode()
+                break
 
         if main_js_url != "":
-            async with ClientSession() as session:  # noqa: SIM117
-                async with session.get(
-                    login_url + main_js_url + "?t=" + str(self.get_ts())
-                ) as resp:
-                    html_text = await resp.text()
-                    x = re.compile(
-                        r"['][A-Za-z0-9][A-Za-z0-9][A-Za-z0-9][A-Za-z0-9][A-Za-z0-9]{36}[']"
+            async with session.get(
+                f"{URL_CIELO}{main_js_url}?t={self.get_ts()}", timeout=API_TIMEOUT
+            ) as resp:
+                keys: list = [
+                    match.group(1).decode()
+                    async for match in _async_search_stream(
+                        resp, _RE_X_API_KEY, _RE_X_API_KEY_MAX_LEN
                     )
-                    keys: list = x.findall(html_text)
-                    if len(keys) > 0:
-                        for x in range(len(keys)):
-                            keys[x] = keys[x].replace("'", "")
-                        self._x_api_keys = keys
+                ]
+                if len(keys) > 0:
+                    self._x_api_keys = keys
+                    CieloHome._x_api_keys_cache = (keys, time.monotonic())
 
         return self._x_api_keys is not None
 
@@ -130,8 +218,8 @@ class CieloHome:
                 self._last_x_api_key = self._entry.data["x_api_key"]
         await self.try_async_refresh_token(test=True)
 
-        if self._access_token != "":
-            self.create_websocket_log_exception(False)
+        if self._access_token != "" and self._supervisor is None:
+            self._supervisor = self.create_task_log_exception(self._async_supervise())
 
         return True
 
@@ -145,24 +233,27 @@ class CieloHome:
     ) -> bool:
         """Set up Cielo Home auth."""
         if self._last_x_api_key is not None:
-            self._headers["x-api-key"] = self._last_x_api_key
+            self._x_api_key = self._last_x_api_key
             res = await self.async_refresh_token(
                 access_token, refresh_token, session_id, user_id, test
             )
             if res:
                 return True
 
+            # the stored key was rejected, the cached keys may have rotated too
+            CieloHome._x_api_keys_cache = None
+
         try:
             await self.set_x_api_key()
-        except Exception:
-            _LOGGER.error(sys.exc_info()[1])
+        except Exception as e:
+            _LOGGER.error(e)
 
         for key in self._x_api_keys:
             if self._last_x_api_key is not None:
                 if self._last_x_api_key == key:
                     continue
 
-            self._headers["x-api-key"] = key
+            self._x_api_key = key
             res = await self.async_refresh_token(
                 access_token, refresh_token, session_id, user_id, test, False
             )
@@ -176,6 +267,8 @@ class CieloHome:
                     )
                 return True
 
+        # none of the cached keys work anymore, fetch main.js again next time
+        CieloHome._x_api_keys_cache = None
         return False
 
     async def async_refresh_token(
@@ -188,13 +281,13 @@ class CieloHome:
         refreshKey: bool = True,
     ) -> bool:
         """Set up Cielo Home refresh."""
-        _LOGGER.debug("Call refreshToken %s", self._headers["x-api-key"])
+        _LOGGER.debug("Call refreshToken %s", self._x_api_key)
 
         if refreshKey:
             try:
                 await self.set_x_api_key()
-            except Exception:
-                _LOGGER.error(sys.exc_info()[1])
+            except Exception as e:
+                _LOGGER.error(e)
 
         # Opening JSON file
         # fullpath: str = str(pathlib.Path(__file__).parent.resolve()) + "/login.json"
@@ -220,70 +313,79 @@ class CieloHome:
                 self._session_id = session_id
                 self._user_id = user_id
 
-            self._headers["authorization"] = self._access_token
-            async with ClientSession() as session:  # noqa: SIM117
-                async with session.get(
-                    "https://"
-                    + URL_API
-                    + "/web/token/refresh?refreshToken="
-                    + self._refresh_token,
-                    headers=self._headers,
-                ) as response:
-                    if response.status == 200:
-                        repjson = await response.json()
-                        if repjson["status"] == 200 and repjson["message"] == "SUCCESS":
-                            self._access_token = repjson["data"]["accessToken"]
-                            self._refresh_token = repjson["data"]["refreshToken"]
-                            expire: int = int(repjson["data"]["expiresIn"]) - 300
-                            if (
-                                expire < self._token_expire_in_ts
-                                or expire < self.get_ts()
-                            ):
-                                self._token_expire_in_ts = (
-                                    self.get_ts() + TIME_REFRESH_TOKEN
+            session = await self._get_session()
+            async with session.get(
+                f"{API_BASE_URL}/web/token/refresh?refreshToken={self._refresh_token}",
+                headers=self._api_headers(),
+                timeout=API_TIMEOUT,
+            ) as response:
+                if response.status == 200:
+                    repjson = await response.json(loads=orjson.loads)
+                    if repjson["status"] == 200 and repjson["message"] == "SUCCESS":
+                        self._access_token = repjson["data"]["accessToken"]
+                        self._refresh_token = repjson["data"]["refreshToken"]
+                        expire: int = int(repjson["data"]["expiresIn"]) - 300
+                        if (
+                            expire < self._token_expire_in_ts
+                            or expire < self.get_ts()
+                        ):
+                            self._token_expire_in_ts = (
+                                self.get_ts() + TIME_REFRESH_TOKEN
+                            )
+                        else:
+                            self._token_expire_in_ts = expire
+
+                        if not test:
+                            if self._entry is not None:
+                                config_data = self._entry.data.copy()
+                                config_data["access_token"] = self._access_token
+                                config_data["refresh_token"] = self._refresh_token
+                                self.hass.config_entries.async_update_entry(
+                                    self._entry, data=config_data
                                 )
-                            else:
-                                self._token_expire_in_ts = expire
-
-                            if not test:
-                                if self._entry is not None:
-                                    config_data = self._entry.data.copy()
-                                    config_data["access_token"] = self._access_token
-                                    config_data["refresh_token"] = self._refresh_token
-                                    self.hass.config_entries.async_update_entry(
-                                        self._entry, data=config_data
-                                    )
-                                _LOGGER.debug("Call refreshToken success")
-                                await self._ws_session.close()
-                                self._last_refresh_token_ts = self.get_ts()
-                            else:
-                                _LOGGER.debug("Call test refreshToken success")
-                            return True
-        except Exception:
-            _LOGGER.error(sys.exc_info()[1])
+                            _LOGGER.debug("Call refreshToken success")
+                            await self._ws_session.close()
+                            self._last_refresh_token_ts = self.get_ts()
+                        else:
+                            _LOGGER.debug("Call test refreshToken success")
+                        return True
+        except Exception as e:
+            _LOGGER.error(e)
 
         return False
 
-    async def async_connect_wss(self, update_state: bool = False):
-        """None."""
-        headers_wss = {
-            "Host": URL_API_WSS,
-            "Cache-control": "no-cache",
-            "Pragma": "no-cache",
-            "User-agent": USER_AGENT,
-        }
+    async def _async_supervise(self) -> None:
+        """Keep the websocket connected until close() is called."""
+        update_state = False
+        while not self._stop_running:
+            await self.async_connect_wss(update_state)
+            if self._stop_running:
+                break
 
+            # for listener in self.__event_listener:
+            #    listener.lost_connection()
+            self.start_timer_connection_lost()
+            if not self._reconnect_now:
+                _LOGGER.debug(
+                    "Try reconnection in " + str(TIMEOUT_RECONNECT) + " secondes"
+                )
+                await asyncio.sleep(TIMEOUT_RECONNECT)
+            else:
+                _LOGGER.debug("Reconnection")
+            self._last_ts_ping = 0
+            update_state = True
+
+    async def async_connect_wss(self, update_state: bool = False):
+        """Run one websocket connection until it is lost."""
         self._reconnect_now = False
-        wss_uri = "wss://" + URL_API_WSS + "/websocket/"
 
         self._is_running = True
-        self._stop_running = False
         try:
             async with ClientSession() as ws_session:
                 self._ws_session = ws_session
                 async with ws_session.ws_connect(
-                    wss_uri,
-                    headers=headers_wss,
+                    WSS_URL,
+                    headers=WSS_HEADERS,
                     params={
                         "sessionId": self._session_id,
                         "token": self._access_token,
@@ -291,6 +393,7 @@ class CieloHome:
                     origin=URL_CIELO[:-1],
                     compress=15,
                     autoping=False,
+                    **({"decode_text": False} if _WSS_RAW_TEXT else {}),
                 ) as websocket:
                     self._websocket = websocket
                     if self._last_ts_ping == 0:
@@ -306,140 +409,136 @@ class CieloHome:
                             self.update_state_device(), False
                         )
                     # self.start_timer_ping()
-                    while self._is_running:
-                        now: int = self.get_ts()
-
-                        try:
-                            msg = await self._websocket.receive(timeout=0.1)
-                            if msg.type in (
-                                WSMsgType.CLOSE,
-                                WSMsgType.CLOSED,
-                                WSMsgType.CLOSING,
-                                WSMsgType.ERROR,
-                            ):
-                                # self._timer_ping.cancel()
-                                _LOGGER.debug("Websocket closed : %s", msg.type)
-                                if (now - self._last_connection_ts) > TIMEOUT_RECONNECT:
-                                    self._reconnect_now = True
-                                break
-
-                            try:
-                                js_data = json.loads(msg.data)
-                                if _LOGGER.isEnabledFor(logging.DEBUG):
-                                    debug_data = copy.copy(js_data)
-                                    if hasattr(debug_data, "accessToken"):
-                                        debug_data["accessToken"] = "*****"
-                                    if hasattr(debug_data, "refreshToken"):
-                                        debug_data["refreshToken"] = "*****"
-                                    _LOGGER.debug(
-                                        "Receive Json : %s", json.dumps(debug_data)
-                                    )
-
-                                with contextlib.suppress(Exception):
-                                    if js_data["message"] == "Internal server error":
-                                        self._last_ts_pong = self.get_ts() + 1
-
-                                with contextlib.suppress(Exception):
-                                    if js_data["message_type"] == "StateUpdate":
-                                        for listener in self.__event_listener:
-                                            listener.data_receive(js_data)
-
-                            except ValueError:
-                                pass
-
-                        except asyncio.exceptions.TimeoutError:
-                            pass
-                        except asyncio.exceptions.CancelledError:
-                            pass
-
-                        if now > (self._token_expire_in_ts):
-                            self._reconnect_now = True
-                            self._token_expire_in_ts = now + 60
-                            self.create_task_log_exception(
-                                self.try_async_refresh_token()
-                            )
-                        elif now - self._last_ts_ping >= TIMER_PING:
-                            self._last_ts_ping = now
-                            self._last_ts_pong = now
-                            self.send_json("ping")
-                        elif (
-                            now > (self._last_ts_pong + TIMER_PONG)
-                        ) and self._last_ts_pong == self._last_ts_ping:
-                            self._reconnect_now = True
-                            self._is_running = False
-
-                        msg: object = None
-                        if len(self._msg_to_send) > 0:
-                            with self._msg_lock:
-                                try:
-                                    while len(self._msg_to_send) > 0:
-                                        msg = self._msg_to_send.pop(0)
-                                        if msg == "ping":
-                                            _LOGGER.debug("Send text : ping")
-                                            await self._websocket.send_str(msg)
-                                        else:
-                                            if _LOGGER.isEnabledFor(logging.DEBUG):
-                                                debug_data = copy.copy(msg)
-                                                # debug_data["token"] = "*****"
-                                                _LOGGER.debug(
-                                                    "Send Json : %s",
-                                                    json.dumps(debug_data),
-                                                )
-
-                                            await self._websocket.send_json(msg)
-
-                                        msg = None
-                                        await asyncio.sleep(0.1)
-                                except Exception:
-                                    _LOGGER.error("Failed to send Json")
-                                    if msg is not None:
-                                        self._msg_to_send.insert(0, msg)
-
-        except Exception:
-            _LOGGER.error(sys.exc_info()[1])
-
-        if hasattr(self, "_ws_session") and not self._ws_session.closed:
-            # self._timer_ping.cancel()
-            await self._ws_session.close()
-
-        if hasattr(self, "_websocket") and not self._websocket.closed:
-            # self._timer_ping.cancel()
-            await self._websocket.close()
-
-        if not self._stop_running:
-            # for listener in self.__event_listener:
-            #    listener.lost_connection()
-            self.start_timer_connection_lost()
-            if not self._reconnect_now:
-                _LOGGER.debug(
-                    "Try reconnection in " + str(TIMEOUT_RECONNECT) + " secondes"
-                )
-                await asyncio.sleep(TIMEOUT_RECONNECT)
+                    tasks = {
+                        asyncio.create_task(self._async_reader()),
+                        asyncio.create_task(self._async_writer()),
+                        asyncio.create_task(self._async_watchdog()),
+                    }
+                    try:
+                        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    finally:
+                        # stop the tasks while the websocket is still open
+                        for task in tasks:
+                            task.cancel()
+                        for result in await asyncio.gather(
+                            *tasks, return_exceptions=True
+                        ):
+                            if isinstance(result, Exception):
+                                _LOGGER.error(result)
+
+        except Exception as e:
+            _LOGGER.error(e)
+
+    async def _async_reader(self) -> None:
+        """Dispatch the messages received on the websocket."""
+        async for msg in self._websocket:
+            if msg.type != WSMsgType.TEXT:
+                if msg.type in (WSMsgType.ERROR, WSMsgType.CLOSE, WSMsgType.CLOSING):
+                    break
+                continue
+
+            _LOGGER.debug("Receive Json : %s", _Redacted(msg.data))
+            try:
+                js_data = orjson.loads(msg.data)
+            except orjson.JSONDecodeError:
+                continue
+
+            if not isinstance(js_data, dict):
+                continue
+
+            if js_data.get("message") == "Internal server error":
+                self._last_ts_pong = self.get_ts() + 1
+
+            if js_data.get("message_type") == "StateUpdate":
+                with contextlib.suppress(Exception):
+                    for listener in self.__event_listener:
+                        listener.data_receive(js_data)
+
+        # self._timer_ping.cancel()
+        _LOGGER.debug("Websocket closed : %s", self._websocket.close_code)
+        if (self.get_ts() - self._last_connection_ts) > TIMEOUT_RECONNECT:
+            self._reconnect_now = True
+
+    async def _async_watchdog(self) -> None:
+        """Refresh the token and check the ping/pong of the websocket."""
+        while self._is_running:
+            await asyncio.sleep(TIMER_WATCHDOG)
+            now: int = self.get_ts()
+
+            if now > (self._token_expire_in_ts):
+                self._reconnect_now = True
+                self._token_expire_in_ts = now + 60
+                self.create_task_log_exception(self.try_async_refresh_token())
+            elif now - self._last_ts_ping >= TIMER_PING:
+                self._last_ts_ping = now
+                self._last_ts_pong = now
+                self.send_json("ping")
+            elif (
+                now > (self._last_ts_pong + TIMER_PONG)
+            ) and self._last_ts_pong == self._last_ts_ping:
+                self._reconnect_now = True
+                self._is_running = False
+
+    async def _async_writer(self) -> None:
+        """Send the queued messages on the websocket."""
+        while self._is_running:
+            if len(self._msg_pending) > 0:
+                batch: list = self._msg_pending
+                self._msg_pending = []
             else:
-                _LOGGER.debug("Reconnection")
-            self._last_ts_ping = 0
-            self.create_websocket_log_exception(True)
+                batch = [await self._msg_to_send.get()]
+            # send everything already queued without waiting on the queue again
+            while not self._msg_to_send.empty():
+                batch.append(self._msg_to_send.get_nowait())
+
+            debug = _LOGGER.isEnabledFor(logging.DEBUG)
+            sent = 0
+            try:
+                for msg in batch:
+                    if msg == "ping":
+                        if debug:
+                            _LOGGER.debug("Send text : ping")
+                        await self._websocket.send_str(msg)
+                    else:
+                        if debug:
+                            _LOGGER.debug("Send Json : %s", _Redacted(msg))
+                        await self._async_send_text(orjson.dumps(msg))
+                    sent += 1
+            except Exception:
+                _LOGGER.error("Failed to send Json")
+                self._is_running = False
+                return
+            finally:
+                # keep the unsent messages, in order, for the next connection,
+                # also when the writer is cancelled; a stale ping is useless
+                unsent = [msg for msg in batch[sent:] if msg != "ping"]
+                if len(unsent) > 0:
+                    _LOGGER.debug("Keep %s message(s) to send", len(unsent))
+                    self._msg_pending = unsent + self._msg_pending
+
+    async def _async_send_text(self, payload: bytes) -> None:
+        """Send an utf-8 encoded payload as a TEXT frame."""
+        if _WSS_SEND_FRAME:
+            await self._websocket.send_frame(payload, WSMsgType.TEXT)
+        else:
+            await self._websocket.send_str(payload.decode())
 
     def send_action(self, msg) -> None:
         """None."""
         # msg["token"] = self._access_token
         msg["mid"] = self._session_id
-        msg["ts"] = self.get_ts()
-
         # to be sure each msg have different ts, when 2 msg are send quickly
-        if msg["ts"] == self._last_ts_msg:
-            msg["ts"] = msg["ts"] + 1
-
-        self._last_ts_msg = msg["ts"]
+        self._last_ts_msg = max(self._last_ts_msg + 1, self.get_ts())
+        msg["ts"] = self._last_ts_msg
 
         self.send_json(msg)
 
     def start_timer_connection_lost(self):
         """None."""
-        self._timer_connection_lost = Timer(
+        self.stop_timer_connection_lost()
+        self._timer_connection_lost = asyncio.get_running_loop().call_later(
             TIMEOUT_RECONNECT + 2, self.dispatch_connection_lost
         )
-        self._timer_connection_lost.start()  # Here run is called
 
     def stop_timer_connection_lost(self):
         """None."""
@@ -449,45 +548,45 @@ class CieloHome:
 
     def dispatch_connection_lost(self):
         """None."""
+        self._timer_connection_lost = None
         for listener in self.__event_listener:
             listener.lost_connection()
 
     def send_json(self, data):
         """None."""
-        with self._msg_lock:
-            try:
-                self._msg_to_send.append(data)
-            except Exception:
-                _LOGGER.error(sys.exc_info()[1])
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # the sync entity methods run in an executor thread,
+            # asyncio.Queue must only be touched from the event loop
+            self.hass.loop.call_soon_threadsafe(self._msg_to_send.put_nowait, data)
+            return
+
+        self._msg_to_send.put_nowait(data)
 
     def get_ts(self) -> int:
         """None."""
-        return int(datetime.now().timestamp())
-        # return int((datetime.utcnow() - datetime.fromtimestamp(0)).total_seconds())
+        return int(time.time())
 
     async def async_get_devices(self):
         """None."""
         devices = await self.async_get_thermostats()
         devicesNotSupported = []
 
-        appliance_ids = ""
         if devices is not None:
+            seen: set[str] = set()
+            ids: list[str] = []
             for device in devices:
                 appliance_id: str = str(device["applianceId"])
                 if appliance_id in ("0", ""):
                     devicesNotSupported.append(device)
                     continue
 
-                if appliance_id in appliance_ids:
-                    continue
-
-                if appliance_ids != "":
-                    appliance_ids = appliance_ids + ","
-
-                appliance_ids = appliance_ids + str(appliance_id)
+                if appliance_id not in seen:
+                    seen.add(appliance_id)
+                    ids.append(appliance_id)
 
-            appliances = await self.async_get_thermostat_info(appliance_ids)
-            appliance_ids = ""
+            appliances = await self.async_get_thermostat_info(",".join(ids))
 
             if len(devicesNotSupported) > 0:
                 for device in devicesNotSupported:
@@ -500,10 +599,10 @@ class CieloHome:
                     )
                     devices.remove(device)
 
+            by_id = {appliance["applianceId"]: appliance for appliance in appliances}
             for device in devices:
-                for appliance in appliances:
-                    if appliance["applianceId"] == device["applianceId"]:
-                        device["appliance"] = appliance
+                if device["applianceId"] in by_id:
+                    device["appliance"] = by_id[device["applianceId"]]
 
             return devices
 
@@ -512,10 +611,12 @@ class CieloHome:
     async def update_state_device(self):
         """None."""
         devices = await self.async_get_thermostats()
-        for listener in self.__event_listener:
-            for device in devices:
-                if device["macAddress"] == listener.get_mac_address():
-                    listener.state_device_receive(device)
+        by_mac = {
+            listener.get_mac_address(): listener for listener in self.__event_listener
+        }
+        for device in devices:
+            if (listener := by_mac.get(device["macAddress"])) is not None:
+                listener.state_device_receive(device)
 
     async def async_get_thermostats(self):
         """Get de the list Devices/Thermostats."""
@@ -536,22 +637,22 @@ class CieloHome:
         if self._last_x_api_key is None:
             await self.try_async_refresh_token()
 
-        self._headers["authorization"] = self._access_token
-        self._headers["x-api-key"] = self._last_x_api_key
+        self._x_api_key = self._last_x_api_key
         devices = None
-        async with ClientSession() as session:  # noqa: SIM117
-            async with session.get(
-                "https://" + URL_API + "/web/devices?limit=420",
-                headers=self._headers,
-            ) as response:
-                if response.status == 200:
-                    repjson = await response.json()
-                    if repjson["status"] == 200 and repjson["message"] == "SUCCESS":
-                        devices = repjson["data"]["listDevices"]
-                        if _LOGGER.isEnabledFor(logging.DEBUG):
-                            _LOGGER.debug("devices : %s", json.dumps(devices))
-                else:
-                    pass
+        session = await self._get_session()
+        async with session.get(
+            f"{API_BASE_URL}/web/devices?limit=420",
+            headers=self._api_headers(),
+            timeout=API_TIMEOUT,
+        ) as response:
+            if response.status == 200:
+                repjson = await response.json(loads=orjson.loads)
+                if repjson["status"] == 200 and repjson["message"] == "SUCCESS":
+                    devices = repjson["data"]["listDevices"]
+                    if _LOGGER.isEnabledFor(logging.DEBUG):
+                        _LOGGER.debug("devices : %s", orjson.dumps(devices).decode())
+            else:
+                pass
 
         devices_supported: list = []
 
@@ -568,35 +669,26 @@ class CieloHome:
     async def async_get_thermostat_info(self, appliance_ids):
         """Get de the list Devices/Thermostats."""
         # https://api.smartcielo.com/web/sync/db/6?applianceIdList=[1674]
-        self._headers["authorization"] = self._access_token
-        self._headers["x-api-key"] = self._last_x_api_key
-        async with ClientSession() as session:  # noqa: SIM117
-            async with session.get(
-                "https://"
-                + URL_API
-                + "/web/sync/db/6?applianceIdList=["
-                + appliance_ids
-                + "]",
-                headers=self._headers,
-            ) as response:
-                if response.status == 200:
-                    repjson = await response.json()
-                    if repjson["status"] == 200 and repjson["message"] == "SUCCESS":
-                        appliances = repjson["data"]["listAppliances"]
-                        if _LOGGER.isEnabledFor(logging.DEBUG):
-                            _LOGGER.debug("appliances : %s", json.dumps(appliances))
-                        return appliances
-                else:
-                    pass
+        self._x_api_key = self._last_x_api_key
+        session = await self._get_session()
+        async with session.get(
+            f"{API_BASE_URL}/web/sync/db/6?applianceIdList=[{appliance_ids}]",
+            headers=self._api_headers(),
+            timeout=API_TIMEOUT,
+        ) as response:
+            if response.status == 200:
+                repjson = await response.json(loads=orjson.loads)
+                if repjson["status"] == 200 and repjson["message"] == "SUCCESS":
+                    appliances = repjson["data"]["listAppliances"]
+                    if _LOGGER.isEnabledFor(logging.DEBUG):
+                        _LOGGER.debug(
+                            "appliances : %s", orjson.dumps(appliances).decode()
+                        )
+                    return appliances
+            else:
+                pass
         return []
 
-    def create_websocket_log_exception(self, update_state: bool = True) -> asyncio.Task:
-        """None."""
-        task = asyncio.create_task(_log_exception(self.async_connect_wss(update_state)))
-        self.background_tasks_wss.add(task)
-        task.add_done_callback(self.call_back_task)
-        return task
-
     def call_back_task(self, task: asyncio.Task):
         """None."""
         self.background_tasks_wss.remove(task)
@@ -613,6 +705,23 @@ class CieloHome:
         return task
 
 
+async def _async_search_stream(
+    resp: ClientResponse, pattern: re.Pattern[bytes], max_len: int
+) -> AsyncIterator[re.Match[bytes]]:
+    """Yield the matches of pattern in the body, without buffering it whole.
+
+    max_len is the longest match of pattern, the tail kept between chunks.
+    """
+    buffer = b""
+    async for chunk in resp.content.iter_chunked(STREAM_CHUNK_SIZE):
+        buffer += chunk
+        end = 0
+        for match in pattern.finditer(buffer):
+            yield match
+            end = match.end()
+        buffer = buffer[max(end, len(buffer) - max_len) :]
+
+
 async def _log_exception(awaitable):
     try:
         return await awaitable
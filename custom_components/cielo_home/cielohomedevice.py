@@ -3,7 +3,6 @@
 import asyncio
 import contextlib
 import logging
-import sys
 from threading import Event, Lock, Timer
 import time
 
@@ -1119,8 +1118,8 @@ class CieloHomeDevice:
 
                 self._timer_state_update = Timer(1, self.dispatch_state_updated)
                 self._timer_state_update.start()
-            except Exception:
-                _LOGGER.error(sys.exc_info()[1])
+            except Exception as e:
+                _LOGGER.error(e)
 
     def dispatch_state_updated(self):
         """None."""
@@ -34,15 +34,18 @@ async def validate_input(hass: HomeAssistant, data: dict[str, Any]) -> dict[str,
 
     api = CieloHome(hass, None)
 
-    if not await api.try_async_refresh_token(
-        data["access_token"],
-        data["refresh_token"],
-        data["session_id"],
-        data["user_id"],
-        True,
-    ):
-        _LOGGER.error("Failed to login to Cielo Home")
-        raise InvalidAuth
+    try:
+        if not await api.try_async_refresh_token(
+            data["access_token"],
+            data["refresh_token"],
+            data["session_id"],
+            data["user_id"],
+            True,
+        ):
+            _LOGGER.error("Failed to login to Cielo Home")
+            raise InvalidAuth
+    finally:
+        await api.close()
 
     # Return info that you want to store in the config entry.
     return {"title": "Cielo Home"}
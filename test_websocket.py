@@ -152,4 +152,9 @@ if __name__ == "__main__":
         print("Run: python test_websocket.py")
         sys.exit(0)
     
-    asyncio.run(test_websocket())
\ No newline at end of file
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(test_websocket())
+    else:
+        uvloop.run(test_websocket())
\ No newline at end of file